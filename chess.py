@@ -1,5 +1,6 @@
 import os
 import random
+import threading
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
 import pygame
 import gym
@@ -186,6 +187,53 @@ class Gomoku(gym.Env):
         self.screen.blit(text_img, text_rect)
         return text_rect
 
+class Ponderer:
+    """ think about the reply to every human move while the human is thinking """
+    def __init__(self, policy, candidates):
+        self.policy = policy
+        self.candidates = candidates
+        self.cache = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def start(self, board, player, last_action=None):
+        """ ponder the replies to the moves `player` may play on `board` """
+        self.stop()
+        # every worker gets its own cache and stop flag, so an old worker that
+        # is still finishing a policy call never has to be joined
+        self.cache, self.stop_event = {}, threading.Event()
+        board = [row[:] for row in board]
+        actions = self.candidates(board)
+        if last_action is not None:
+            # the human usually answers close to the last stone
+            x, y = last_action
+            actions = sorted(actions, key=lambda a: max(abs(a[0]-x), abs(a[1]-y)))
+        args = (board, player, actions, self.cache, self.stop_event)
+        threading.Thread(target=self.ponder, args=args, daemon=True).start()
+
+    def ponder(self, board, player, actions, cache, stop_event):
+        for m, n in actions:
+            if stop_event.is_set():
+                return
+            board[m][n] = player
+            reply = self.policy(board)
+            board[m][n] = 0
+            with self.lock:
+                cache[(m, n)] = reply
+
+    def stop(self):
+        self.stop_event.set()
+
+    def reply(self, action, board):
+        """ return the pondered reply to `action`, or search it now on a miss """
+        with self.lock:
+            hit = action in self.cache
+            reply = self.cache.get(action)
+        self.stop()
+        if hit:
+            return reply, True
+        return self.policy(board), False
+
 def test_is_win(game):
     tests = [
         [(0, 0)],
@@ -1,9 +1,16 @@
-from chess import Gomoku
+from chess import Gomoku, Ponderer
 import random
 import math
 from collections import defaultdict
 from typing import List, Callable, Tuple, Any
+import argparse
 import copy
+import os
+import pickle
+import tempfile
+from itertools import islice
+import numpy as np
+from time import perf_counter, sleep
 
 class QLearningAlgorithm():
     def __init__(self, actions: Callable, discount: float, featureExtractor: Callable, explorationProb=0.2):
@@ -19,9 +26,6 @@ class QLearningAlgorithm():
         score = 0
         for f, v in self.featureExtractor(state, action):
             score += self.weights[f] * v
-        if score:
-            print(self.weights)
-            print(score, action)
         return score
 
     # This algorithm will produce an action given a state.
@@ -37,6 +41,14 @@ class QLearningAlgorithm():
         else:
             return max((self.getQ(state, action), action) for action in self.actions(state))[1]
 
+    # Return the action with the highest Q value, without exploring and without
+    # touching |numIters|, so it is safe to call from a background thread.
+    def getGreedyAction(self, state: Tuple) -> Any:
+        actions = self.actions(state)
+        if not actions or not state:
+            return None
+        return max((self.getQ(state, action), action) for action in actions)[1]
+
     # Call this function to get the step size to update the weights.
     def getStepSize(self) -> float:
         return 1.0 / math.sqrt(self.numIters)
@@ -180,6 +192,318 @@ def simulate(mdp, rl, numTrials=10, maxIterations=1000, verbose=False,
         totalRewards.append(totalReward)
     return totalRewards
 
+############################################################
+
+# Boards are recorded as the bytes of an int8 array, which pickle and load far
+# faster than nested lists.
+def encodeBoard(board) -> Any:
+    return np.array(board, dtype=np.int8).tobytes() if board else None
+
+def decodeBoard(data) -> Any:
+    if not isinstance(data, bytes):
+        return data
+    N = math.isqrt(len(data))
+    return np.frombuffer(data, dtype=np.int8).reshape(N, N).tolist()
+
+# Wraps an RL algorithm so that every (s, a, r, s') seen by |simulate| is also
+# appended to |path|, one pickled tuple per transition with encoded boards.
+class TransitionRecorder():
+    def __init__(self, rl, path: str):
+        self.rl = rl
+        self.file = open(path, 'ab')
+        self.state = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # GomokuMDP.succAndProbReward places the stone on |state| in place, so keep
+    # a copy of the board from before the move to record as s.
+    def getAction(self, state: Tuple) -> Any:
+        self.state = encodeBoard(state)
+        return self.rl.getAction(state)
+
+    def incorporateFeedback(self, state: Tuple, action: Any, reward: int, newState: Tuple) -> None:
+        if self.state is None:
+            self.state = encodeBoard(state)
+        record = (self.state, action, reward, encodeBoard(newState))
+        pickle.dump(record, self.file, pickle.HIGHEST_PROTOCOL)
+        self.state = None
+        self.rl.incorporateFeedback(state, action, reward, newState)
+
+    def close(self) -> None:
+        self.file.close()
+
+# Yield the transitions stored in |path| as lists of at most |chunkSize|. With
+# |decode|, boards recorded by TransitionRecorder are turned back into lists.
+def loadTransitions(path: str, chunkSize: int, decode=True):
+    def records(f):
+        while True:
+            try:
+                state, action, reward, newState = pickle.load(f)
+            except EOFError:
+                return
+            if decode:
+                state, newState = decodeBoard(state), decodeBoard(newState)
+            yield state, action, reward, newState
+    with open(path, 'rb') as f:
+        it = records(f)
+        chunk = list(islice(it, chunkSize))
+        while chunk:
+            yield chunk
+            chunk = list(islice(it, chunkSize))
+
+# Offline fitted-Q iteration for the linear Q function of a QLearningAlgorithm.
+# The transitions are streamed from disk in chunks and featurized into sparse
+# (row, col, value) arrays. Each of |numIters| passes freezes the weights as the
+# target and, for every chunk, takes |numSweeps| minibatch gradient steps
+# towards r + discount * max_a' Q_target(s', a').
+#
+# With |batchFeatureExtractor| (e.g. batchRuleFeatureExtractor) the states must
+# be boards whose legal actions are the empty cells, as in GomokuMDP, and a
+# whole chunk is featurized with NumPy at once straight from the recorded
+# bytes. phi(s_t+1, a_t+1) is not featurized again when it is already among
+# the phi(s'_t, a') rows. Without it, rl.featureExtractor is called once per
+# (state, action) pair.
+#
+# RAM is bounded by |chunkSize| plus one weight per distinct feature. With
+# numIters > 1 the features are featurized once and cached on disk with
+# np.savez_compressed, in |cacheDir| if given (and kept) or in a temporary
+# directory; with ruleFeatureExtractor on an 8x8 board that is about 100
+# bytes per transition. With numIters == 1 nothing is written to disk.
+class BatchQLearningAlgorithm():
+    def __init__(self, rl, stepSize=0.01, numSweeps=1, chunkSize=10000, batchFeatureExtractor=None):
+        self.rl = rl
+        self.stepSize = stepSize
+        self.numSweeps = numSweeps
+        self.chunkSize = chunkSize
+        self.batchFeatureExtractor = batchFeatureExtractor
+        self.featureIndex = {}
+        for f in rl.weights:
+            self.featureIndex[f] = len(self.featureIndex)
+        self.weights = np.array([rl.weights[f] for f in self.featureIndex], dtype=float)
+        self.targetWeights = self.weights.copy()
+
+    def growWeights(self) -> None:
+        grow = len(self.featureIndex) - len(self.weights)
+        if grow > 0:
+            self.weights = np.concatenate([self.weights, np.zeros(grow)])
+            self.targetWeights = np.concatenate([self.targetWeights, np.zeros(grow)])
+
+    def getFeatureIds(self, keys: List) -> np.ndarray:
+        ids = [self.featureIndex.setdefault(f, len(self.featureIndex)) for f in keys]
+        self.growWeights()
+        return np.array(ids, dtype=np.int64)
+
+    # Return the sparse feature matrix of the (state, action) |pairs| as
+    # (rows, cols, values, numRows).
+    def featurize(self, pairs: List[Tuple]) -> Tuple:
+        rows, keys, vals = [], [], []
+        for i, (state, action) in enumerate(pairs):
+            for f, v in self.rl.featureExtractor(state, action):
+                rows.append(i)
+                keys.append(f)
+                vals.append(v)
+        return (np.array(rows, dtype=np.int64), self.getFeatureIds(keys),
+                np.array(vals, dtype=float), len(pairs))
+
+    # Same as |featurize| for the pairs (states[stateIdx[k]], actions[k]), where
+    # |states| is a (K, N, N) array of boards, using |batchFeatureExtractor|.
+    def batchFeaturize(self, states: np.ndarray, stateIdx: np.ndarray, actions: np.ndarray) -> Tuple:
+        if not len(stateIdx):
+            return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0), 0)
+        rows, cols, vals, keys = self.batchFeatureExtractor(states, stateIdx, actions)
+        return rows, self.getFeatureIds(keys)[cols], vals, len(stateIdx)
+
+    # Return the rows |rowIdx| of the sparse matrix |X|, renumbered 0, 1, ...
+    @staticmethod
+    def selectRows(X: Tuple, rowIdx: np.ndarray) -> Tuple:
+        rows, cols, vals, n = X
+        order = np.argsort(rows, kind='stable')
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n))])
+        lengths = indptr[rowIdx + 1] - indptr[rowIdx]
+        offsets = np.repeat(indptr[rowIdx] - (np.cumsum(lengths) - lengths), lengths)
+        take = order[offsets + np.arange(lengths.sum())]
+        return np.repeat(np.arange(len(rowIdx)), lengths), cols[take], vals[take], len(rowIdx)
+
+    # Stack sparse matrices whose rows go to positions |rowPos| of a matrix
+    # with |n| rows.
+    @staticmethod
+    def stackRows(parts: List[Tuple], n: int) -> Tuple:
+        rows = np.concatenate([rowPos[X[0]] for X, rowPos in parts])
+        cols = np.concatenate([X[1] for X, rowPos in parts])
+        vals = np.concatenate([X[2] for X, rowPos in parts])
+        return rows, cols, vals, n
+
+    # Featurize a chunk of transitions: phi(s, a) for every transition and
+    # phi(s', a') for every legal a' of every non-terminal s'.
+    def extractChunk(self, chunk: List[Tuple]) -> Tuple:
+        if self.batchFeatureExtractor is not None:
+            return self.batchExtractChunk(chunk)
+        pairs, nextPairs, nextIdx, starts = [], [], [], []
+        rewards = np.empty(len(chunk))
+        for i, (state, action, reward, newState) in enumerate(chunk):
+            pairs.append((state, action))
+            rewards[i] = reward
+            nextActions = [] if newState is None else self.rl.actions(newState)
+            if nextActions:
+                nextIdx.append(i)
+                starts.append(len(nextPairs))
+                nextPairs.extend((newState, a) for a in nextActions)
+        return (self.featurize(pairs), self.featurize(nextPairs), rewards,
+                np.array(nextIdx, dtype=np.int64), np.array(starts, dtype=np.int64))
+
+    def batchExtractChunk(self, chunk: List[Tuple]) -> Tuple:
+        n = len(chunk)
+        rewards = np.array([t[2] for t in chunk], dtype=float)
+        # terminal records such as (None, None, 0, None) go through featureExtractor
+        board = np.array([bool(t[0]) and t[1] is not None for t in chunk])
+        hasNext = np.array([bool(t[3]) for t in chunk])
+        boardIdx, nextIdx = np.flatnonzero(board), np.flatnonzero(hasNext)
+        N = next((math.isqrt(len(b)) if isinstance(b, bytes) else len(b)
+                  for t in chunk for b in (t[0], t[3]) if b), 1)
+        def boards(items):
+            data = b''.join(b if isinstance(b, bytes) else encodeBoard(b) for b in items)
+            return np.frombuffer(data, dtype=np.int8).reshape(-1, N, N)
+        states = boards(chunk[i][0] for i in boardIdx)
+        actions = np.array([chunk[i][1] for i in boardIdx], dtype=np.int64).reshape(-1, 2)
+        nextStates = boards(chunk[i][3] for i in nextIdx)
+
+        # phi(s', a') for every empty cell a' of every s', in the order of
+        # GomokuMDP.actions
+        empty = (nextStates == 0).reshape(len(nextIdx), N * N)
+        numActions = empty.sum(axis=1)
+        live = numActions > 0
+        nextIdx, nextStates, empty, numActions = nextIdx[live], nextStates[live], empty[live], numActions[live]
+        starts = np.cumsum(numActions) - numActions
+        pairIdx, cell = np.nonzero(empty)
+        XNext = self.batchFeaturize(nextStates, pairIdx, np.stack([cell // N, cell % N], axis=1))
+
+        # reuse phi(s_t+1, a_t+1) when s_t+1 is s'_t
+        nextPos = np.full(n, -1)
+        nextPos[nextIdx] = np.arange(len(nextIdx))
+        boardPos = np.full(n, -1)
+        boardPos[boardIdx] = np.arange(len(boardIdx))
+        cand = boardIdx[(boardIdx > 0) & (nextPos[boardIdx - 1] >= 0)]
+        prev = nextPos[cand - 1]
+        same = (states[boardPos[cand]] == nextStates[prev]).all(axis=(1, 2))
+        cand, prev = cand[same], prev[same]
+        flat = actions[boardPos[cand], 0] * N + actions[boardPos[cand], 1]
+        rank = np.cumsum(empty[prev], axis=1)[np.arange(len(cand)), flat] - 1
+        reused = np.zeros(n, dtype=bool)
+        reused[cand] = True
+
+        fresh = boardIdx[~reused[boardIdx]]
+        other = np.flatnonzero(~board)
+        parts = [(self.batchFeaturize(states, boardPos[fresh], actions[boardPos[fresh]]), fresh),
+                 (self.selectRows(XNext, starts[prev] + rank), cand),
+                 (self.featurize([(decodeBoard(chunk[i][0]), chunk[i][1]) for i in other]), other)]
+        return self.stackRows(parts, n), XNext, rewards, nextIdx, starts
+
+    @staticmethod
+    def matvec(X: Tuple, w: np.ndarray) -> np.ndarray:
+        rows, cols, vals, n = X
+        return np.bincount(rows, weights=vals * w[cols], minlength=n)
+
+    def sweep(self, features: Tuple) -> None:
+        X, XNext, rewards, nextIdx, starts = features
+        VOpt = np.zeros(len(rewards))
+        if len(starts):
+            VOpt[nextIdx] = np.maximum.reduceat(self.matvec(XNext, self.targetWeights), starts)
+        residual = self.matvec(X, self.weights) - (rewards + self.rl.discount * VOpt)
+        rows, cols, vals, n = X
+        gradient = np.bincount(cols, weights=vals * residual[rows], minlength=len(self.weights))
+        self.weights -= self.stepSize * gradient / n
+
+    # The batch path reads the recorded boards without turning them into lists.
+    def loadChunks(self, path: str):
+        return loadTransitions(path, self.chunkSize, decode=self.batchFeatureExtractor is None)
+
+    # Featurize every chunk of |path| once and save it to |cacheDir|.
+    # Return the list of saved files.
+    def cacheFeatures(self, path: str, cacheDir: str) -> List[str]:
+        files = []
+        for i, chunk in enumerate(self.loadChunks(path)):
+            X, XNext, rewards, nextIdx, starts = self.extractChunk(chunk)
+            name = os.path.join(cacheDir, f"chunk{i}.npz")
+            np.savez_compressed(name, rows=X[0], cols=X[1], vals=X[2], n=X[3],
+                                nextRows=XNext[0], nextCols=XNext[1], nextVals=XNext[2], m=XNext[3],
+                                rewards=rewards, nextIdx=nextIdx, starts=starts)
+            files.append(name)
+        return files
+
+    @staticmethod
+    def loadFeatures(name: str) -> Tuple:
+        with np.load(name) as f:
+            return ((f['rows'], f['cols'], f['vals'], int(f['n'])),
+                    (f['nextRows'], f['nextCols'], f['nextVals'], int(f['m'])),
+                    f['rewards'], f['nextIdx'], f['starts'])
+
+    def train(self, path: str, numIters=1, cacheDir=None) -> None:
+        if numIters == 1:
+            self.targetWeights = self.weights.copy()
+            for chunk in self.loadChunks(path):
+                features = self.extractChunk(chunk)
+                for _ in range(self.numSweeps):
+                    self.sweep(features)
+        else:
+            with tempfile.TemporaryDirectory() as tmp:
+                files = self.cacheFeatures(path, cacheDir or tmp)
+                for _ in range(numIters):
+                    self.targetWeights = self.weights.copy()
+                    for name in files:
+                        features = self.loadFeatures(name)
+                        for _ in range(self.numSweeps):
+                            self.sweep(features)
+        self.writeWeights()
+
+    # Copy the learned weights back into the wrapped QLearningAlgorithm.
+    def writeWeights(self) -> None:
+        for f, j in self.featureIndex.items():
+            self.rl.weights[f] = float(self.weights[j])
+
+def test_batch_q_learning():
+    actions = lambda state: [0, 1, 2]
+    features = lambda state, action: [((state, action), 1.0), ('bias', 0.5)] if action is not None else []
+    rl = QLearningAlgorithm(actions, 0.9, features)
+    rl.numIters = 4
+    for state in range(3):
+        for action in range(3):
+            rl.weights[(state, action)] = random.uniform(-1, 1)
+    rl.weights['bias'] = 0.3
+    # some s' are terminal (None), one chunk is terminal only
+    transitions = [(0, 1, 1, 2), (1, 0, -1, None), (2, 2, 5, 0), (1, 1, 0, 1),
+                   (0, 0, 2, None), (2, 1, 1, None)]
+
+    # matvec and reduceat agree with getQ and the max over a'
+    batch = BatchQLearningAlgorithm(copy.deepcopy(rl), chunkSize=3)
+    for chunk in (transitions[:3], transitions[3:], transitions[4:]):
+        X, XNext, rewards, nextIdx, starts = batch.extractChunk(chunk)
+        Q = batch.matvec(X, batch.weights)
+        VOpt = np.zeros(len(chunk))
+        if len(starts):
+            VOpt[nextIdx] = np.maximum.reduceat(batch.matvec(XNext, batch.weights), starts)
+        for i, (s, a, r, ns) in enumerate(chunk):
+            expect = 0 if ns is None else max(rl.getQ(ns, act) for act in actions(ns))
+            assert np.isclose(Q[i], rl.getQ(s, a)), f"Q{(s, a)} expect {rl.getQ(s, a)}, got {Q[i]}"
+            assert np.isclose(VOpt[i], expect), f"V({ns}) expect {expect}, got {VOpt[i]}"
+
+    # one transition per chunk and one sweep is exactly incorporateFeedback
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'transitions.pkl')
+        for t in transitions[:2]:
+            online = copy.deepcopy(rl)
+            online.incorporateFeedback(*t)
+            with open(path, 'wb') as f:
+                pickle.dump(t, f)
+            offline = copy.deepcopy(rl)
+            BatchQLearningAlgorithm(offline, stepSize=rl.getStepSize(), chunkSize=1).train(path)
+            for k in online.weights:
+                assert np.isclose(online.weights[k], offline.weights[k]), \
+                    f"{t}: weight {k} expect {online.weights[k]}, got {offline.weights[k]}"
+
 def manhattanDistance( xy1, xy2 ):
   "Returns the Manhattan distance between points xy1 and xy2"
   return abs( xy1[0] - xy2[0] ) + abs( xy1[1] - xy2[1] )
@@ -261,20 +585,199 @@ def ruleFeatureExtractor(state, action) -> List[Tuple[Tuple, int]]:
         black_stone.append(action)
     return [('white', eval_stone(white_stone)),('black', eval_stone(black_stone))]
 
-def interactive(rl):
+# NumPy version of eval_stone for a batch of boards, split so that it can be
+# evaluated for any extra stone: |stones| is a (K, N, N) bool array. Returns
+# the score and win of each board, plus for every cell the score added and
+# whether five are made by putting one more stone there.
+def eval_stone_maps(stones):
+    K, N, _ = stones.shape
+    def pad(grid):
+        padded = np.zeros((K, N+8, N+8), dtype=np.int8)
+        padded[:, 4:4+N, 4:4+N] = grid
+        return padded
+    def at(padded, dx, dy):
+        # grid[p + (dx, dy)] for every cell p, 0 off the board
+        return padded[:, 4+dx:4+dx+N, 4+dy:4+dy+N]
+    padded = pad(stones)
+    board = at(padded, 0, 0)
+    ahead = np.zeros((K, N, N), dtype=np.int8)
+    delta = np.zeros((K, N, N), dtype=np.int8)
+    five = np.zeros((K, N, N), dtype=bool)
+    winMap = np.zeros((K, N, N), dtype=np.int8)
+    for dx, dy in ((0, 1), (1, 0), (1, 1), (1, -1)):
+        # window[p] counts the stones of the five cells starting at p
+        window = board.copy()
+        for i in range(1, 5):
+            window += at(padded, i*dx, i*dy)
+            delta += at(padded, -i*dx, -i*dy)
+        ahead += window - board
+        five |= window == 5
+        four = pad(window == 4)
+        for i in range(5):
+            winMap |= at(four, -i*dx, -i*dy)
+    # a stone adds one to the score for every stone 1 to 4 cells ahead of it
+    # and for every stone 1 to 4 cells behind it
+    delta += ahead
+    score = (board * ahead).reshape(K, -1).sum(axis=1)
+    win = five.reshape(K, -1).any(axis=1)
+    return score, win, delta, winMap.astype(bool)
+
+# Batch version of ruleFeatureExtractor for BatchQLearningAlgorithm. The pairs
+# are (states[stateIdx[k]], actions[k]), where |states| is a (K, N, N) int
+# array of boards and |actions| a (len(stateIdx), 2) int array of empty cells,
+# so the boards shared by many actions are evaluated once.
+# Returns the features as (rows, cols, values, keys), where cols index into keys.
+def batchRuleFeatureExtractor(states, stateIdx, actions):
+    white, black = states == 1, states == -1
+    player = np.where(white.sum(axis=(1, 2)) > black.sum(axis=(1, 2)), -1, 1)[stateIdx]
+    x, y = actions[:, 0], actions[:, 1]
+    vals = []
+    for color, stones in ((1, white), (-1, black)):
+        score, win, delta, winMap = eval_stone_maps(stones)
+        score, win = score[stateIdx], win[stateIdx]
+        moved = player == color
+        score = np.where(moved, score + delta[stateIdx, x, y], score)
+        win = win | (moved & winMap[stateIdx, x, y])
+        vals.append(np.where(win, 5000, score))
+    K = len(stateIdx)
+    return (np.repeat(np.arange(K), 2), np.tile([0, 1], K),
+            np.stack(vals, axis=1).ravel().astype(float), ['white', 'black'])
+
+def test_batch_rule_feature_extractor():
+    # batchRuleFeatureExtractor agrees with ruleFeatureExtractor
+    N = 8
+    for _ in range(500):
+        density = random.random()
+        state = [[random.choice([1, -1]) if random.random() < density else 0 for _ in range(N)] for _ in range(N)]
+        empty = [(m, n) for m in range(N) for n in range(N) if state[m][n] == 0]
+        if not empty:
+            continue
+        action = random.choice(empty)
+        expect = dict(ruleFeatureExtractor(state, action))
+        rows, cols, vals, keys = batchRuleFeatureExtractor(np.array([state], dtype=np.int8), np.array([0]),
+                                                           np.array([action]))
+        got = {keys[c]: v for c, v in zip(cols, vals)}
+        assert got == expect, f"{state} {action}: expect {expect}, got {got}"
+
+    # the batch chunk path, including reused phi(s_t+1, a_t+1) rows, gives the
+    # same features as the featureExtractor path
+    rl = QLearningAlgorithm(gomoku_game.actions, gomoku_game.discount(), ruleFeatureExtractor, explorationProb=1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'transitions.pkl')
+        with TransitionRecorder(rl, path) as recorder:
+            simulate(gomoku_game, recorder, numTrials=5)
+        for chunk in loadTransitions(path, 1000):
+            for state, action, reward, newState in chunk:
+                if state and action is not None:
+                    assert state[action[0]][action[1]] == 0, f"{action} is occupied in the recorded s"
+        weights = {'white': 0.3, 'black': -0.7, 'none': 2.0}
+        for chunkSize in (1, 7, 1000):
+            scalar = BatchQLearningAlgorithm(rl, chunkSize=chunkSize)
+            batch = BatchQLearningAlgorithm(rl, chunkSize=chunkSize, batchFeatureExtractor=batchRuleFeatureExtractor)
+            for raw, chunk in zip(batch.loadChunks(path), scalar.loadChunks(path)):
+                got, expect = batch.extractChunk(raw), scalar.extractChunk(chunk)
+                wGot = np.array([weights[f] for f in batch.featureIndex])
+                wExpect = np.array([weights[f] for f in scalar.featureIndex])
+                for X, Y in zip(got[:2], expect[:2]):
+                    assert X[3] == Y[3], f"expect {Y[3]} rows, got {X[3]}"
+                    assert np.allclose(batch.matvec(X, wGot), scalar.matvec(Y, wExpect)), "features differ"
+                for a, b in zip(got[2:], expect[2:]):
+                    assert np.array_equal(a, b), f"expect {b}, got {a}"
+
+# With |ponder|, the bot plays the greedy reply it worked out during the human's
+# turn; without it, the bot replies with the usual epsilon-greedy rl.getAction.
+def interactive(rl, ponder=True):
     game = Gomoku(n=8, gui=True)
     game.draw_board()
+    ponderer = Ponderer(rl.getGreedyAction, rl.actions) if ponder else None
+    latency, hits = [], 0
+    action = None
     while game.winner is None:
+        if ponderer:
+            ponderer.start(game.chess_board, game.next_player, action)
         action = game.human_step()
         if action is None:
             break
         game.step(action)
-        action = rl.getAction(game.chess_board)
+        start = perf_counter()
+        if ponderer:
+            action, hit = ponderer.reply(action, game.chess_board)
+            hits += hit
+        else:
+            action = rl.getAction(game.chess_board)
+        latency.append(perf_counter() - start)
         if action is None:
             break
         game.step(action)
+    if ponderer:
+        ponderer.stop()
+    if latency:
+        print(f"ponder {ponder}: {len(latency)} replies, {hits} pondered, "
+              f"mean latency {1000*sum(latency)/len(latency):.1f}ms, max {1000*max(latency):.1f}ms")
 
-# q_rl = QLearningAlgorithm(gomoku_game.actions, gomoku_game.discount(), simpleFeatureExtractor)
-q_rl = QLearningAlgorithm(gomoku_game.actions, gomoku_game.discount(), ruleFeatureExtractor, explorationProb=0.01)
-q_rewards = simulate(gomoku_game, q_rl, numTrials=10)
-interactive(q_rl)
+# Measure the bot's reply latency without a GUI: a random "human" thinks for
+# |think_time| seconds on a plain board, then the reply is timed. Replies are
+# chosen the same way as in |interactive|.
+def measure_ponder_latency(rl, ponder=True, think_time=1.0, num_moves=10, n=8):
+    board = [[0]*n for _ in range(n)]
+    ponderer = Ponderer(rl.getGreedyAction, rl.actions) if ponder else None
+    latency = {True: [], False: []}
+    action = None
+    for _ in range(num_moves):
+        if ponderer:
+            ponderer.start(board, 1, action)
+        sleep(think_time)
+        x, y = random.choice(rl.actions(board))
+        board[x][y] = 1
+        start = perf_counter()
+        if ponderer:
+            action, hit = ponderer.reply((x, y), board)
+        else:
+            action, hit = rl.getAction(board), False
+        latency[hit].append(perf_counter() - start)
+        if action is None:
+            break
+        board[action[0]][action[1]] = -1
+    if ponderer:
+        ponderer.stop()
+    for hit, times in latency.items():
+        if times:
+            print(f"ponder {ponder}, think {think_time}s, {'hit' if hit else 'miss'}: {len(times)} replies, "
+                  f"mean {1000*sum(times)/len(times):.1f}ms, max {1000*max(times):.1f}ms")
+    return latency
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--measure-ponder', action='store_true',
+                        help="print headless reply latency with and without pondering instead of playing")
+    parser.add_argument('--check', action='store_true',
+                        help="run the batch trainer checks instead of playing")
+    parser.add_argument('--record', metavar='PATH',
+                        help="append the transitions of --record-trials simulated games to PATH")
+    parser.add_argument('--record-trials', type=int, default=1000)
+    parser.add_argument('--train', metavar='PATH',
+                        help="train the weights offline on the transitions in PATH before playing")
+    parser.add_argument('--train-iters', type=int, default=5)
+    args = parser.parse_args()
+    if args.check:
+        test_batch_q_learning()
+        test_batch_rule_feature_extractor()
+        print("batch trainer checks passed")
+    else:
+        # q_rl = QLearningAlgorithm(gomoku_game.actions, gomoku_game.discount(), simpleFeatureExtractor)
+        q_rl = QLearningAlgorithm(gomoku_game.actions, gomoku_game.discount(), ruleFeatureExtractor, explorationProb=0.01)
+        q_rewards = simulate(gomoku_game, q_rl, numTrials=10)
+        if args.record:
+            with TransitionRecorder(q_rl, args.record) as recorder:
+                simulate(gomoku_game, recorder, numTrials=args.record_trials)
+        if args.train:
+            batch = BatchQLearningAlgorithm(q_rl, stepSize=1e-8, numSweeps=4,
+                                            batchFeatureExtractor=batchRuleFeatureExtractor)
+            batch.train(args.train, numIters=args.train_iters)
+        if args.measure_ponder:
+            for ponder in (False, True):
+                for think_time in (0.02, 0.1, 0.5):
+                    random.seed(1)
+                    measure_ponder_latency(q_rl, ponder=ponder, think_time=think_time, num_moves=15)
+        else:
+            interactive(q_rl)